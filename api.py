@@ -1,4 +1,5 @@
-import time
+from argparse import ArgumentTypeError
+from typing import Literal
 
 from curl_cffi import requests
 
@@ -48,33 +49,74 @@ def make_pair(
     )
 
 
-def make_pair_exp_backoff(
-    pair: PendingPair,
-    headers: dict[str, str],
-    *,
-    timeout: float = 30,
-) -> Pair:
-    started_at = time.perf_counter()
-    backoff = 1
-    while True:
-        exc = None
-        try:
-            eta = timeout - (time.perf_counter() - started_at)
-            return make_pair(pair, headers, timeout=eta)
-        except requests.RequestsError as e:
-            if e.args and e.args[0].startswith("HTTP Error 500:"):
-                raise  # don't bother retrying
-            exc = e
-        except Exception as e:
-            exc = e
-
-        eta = timeout - (time.perf_counter() - started_at)
-        if eta < backoff:
-            msg = f"Ran out of time while making the pair: {pair}"
-            raise TimeoutError(msg) from exc
-
-        time.sleep(backoff)
-        backoff = min(backoff * 2, 60)
+ErrorClass = Literal["server", "rate_limit", "timeout", "network", "other"]
+ERROR_CLASSES: list[ErrorClass] = ["server", "rate_limit", "timeout", "network", "other"]
+
+
+def classify_error(exc: BaseException) -> ErrorClass:
+    if isinstance(exc, requests.RequestsError):
+        message = str(exc.args[0]) if exc.args else ""
+        if message.startswith("HTTP Error 500:"):
+            return "server"
+        if message.startswith("HTTP Error 429:"):
+            return "rate_limit"
+        if getattr(exc, "code", None) == 28 or "timed out" in message.lower():
+            return "timeout"
+        return "network"
+
+    if isinstance(exc, TimeoutError):
+        return "timeout"
+
+    return "other"
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        deadline: float,
+        backoff: float = 1,
+        max_backoff: float = 60,
+    ) -> None:
+        self.deadline = deadline
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def __str__(self) -> str:
+        return f"{self.deadline:g},{self.backoff:g},{self.max_backoff:g}"
+
+    def delay(self, attempts: int, elapsed: float) -> float | None:
+        # `None` means the deadline would be exceeded, so the pair should not be retried
+        delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+        if elapsed + delay > self.deadline:
+            return None
+        return delay
+
+
+RETRY_POLICIES: dict[ErrorClass, RetryPolicy] = {
+    "server": RetryPolicy(0),  # don't bother retrying
+    "rate_limit": RetryPolicy(120, 5, 60),
+    "timeout": RetryPolicy(20),  # must exceed the request timeout, or timeouts are never retried
+    "network": RetryPolicy(5),
+    "other": RetryPolicy(5),
+}
+
+
+def parse_retry_policy(value: str) -> tuple[ErrorClass, RetryPolicy]:
+    error_class, _, numbers = value.partition("=")
+    if error_class not in ERROR_CLASSES:
+        msg = f"unknown error class {error_class!r}, expected one of: {', '.join(ERROR_CLASSES)}"
+        raise ArgumentTypeError(msg)
+
+    parts = numbers.split(",")
+    if not 1 <= len(parts) <= 3:
+        msg = f"expected {error_class}=DEADLINE[,BACKOFF[,MAX_BACKOFF]], got {value!r}"
+        raise ArgumentTypeError(msg)
+
+    try:
+        return error_class, RetryPolicy(*(float(n) for n in parts))
+    except ValueError:
+        msg = f"expected numbers of seconds in {value!r}"
+        raise ArgumentTypeError(msg) from None
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+import json
+import os
+from pathlib import Path
+
+import persistence
+from models import Element, PendingPair
+
+# Relative to the working directory, just like `cache.sqlite`
+path = Path("scan-checkpoint.json")
+
+
+class Checkpoint:
+    def __init__(
+        self,
+        orders: list[persistence.PendingPairOrder],
+        candidates: list[PendingPair],
+        retries: list[tuple[PendingPair, float, int, float, float | None]],
+        failed: list[PendingPair],
+    ) -> None:
+        self.orders = orders
+        # pairs which were in-flight or queued, and should be requested first
+        self.candidates = candidates
+        # (pending pair, seconds until the retry, number of attempts so far,
+        #  seconds since the first attempt, seconds until the retry deadline)
+        self.retries = retries
+        self.failed = failed
+
+
+# Only names are saved, since element ids are specific to the database they came from
+def _dump_pair(pending_pair: PendingPair) -> list[str]:
+    return [pending_pair.first.name, pending_pair.second.name]
+
+
+def _load_pair(data: list[str]) -> PendingPair:
+    first, second = data
+    if not isinstance(first, str) or not isinstance(second, str):
+        msg = f"Invalid pair: {data!r}"
+        raise ValueError(msg)
+
+    return PendingPair(Element(first), Element(second))
+
+
+def save(checkpoint: Checkpoint) -> None:
+    data = {
+        "orders": checkpoint.orders,
+        "candidates": [_dump_pair(p) for p in checkpoint.candidates],
+        "retries": [
+            [_dump_pair(p), delay, n_attempts, elapsed, deadline]
+            for p, delay, n_attempts, elapsed, deadline in checkpoint.retries
+        ],
+        "failed": [_dump_pair(p) for p in checkpoint.failed],
+    }
+
+    # write to a temporary file first, so that an interruption never leaves a partial checkpoint behind
+    temporary_path = path.with_suffix(".tmp")
+    temporary_path.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(temporary_path, path)
+
+
+def load() -> Checkpoint | None:
+    if not path.exists():
+        return None
+
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+
+        orders = data["orders"]
+        if sorted(orders) != sorted(persistence.PENDING_PAIR_ORDERS):
+            msg = f"Unknown pending pair orders: {orders!r}"
+            raise ValueError(msg)
+
+        return Checkpoint(
+            orders,
+            [_load_pair(p) for p in data["candidates"]],
+            [
+                (
+                    _load_pair(p),
+                    float(delay),
+                    int(n_attempts),
+                    float(elapsed),
+                    None if deadline is None else float(deadline),
+                )
+                for p, delay, n_attempts, elapsed, deadline in data["retries"]
+            ],
+            [_load_pair(p) for p in data["failed"]],
+        )
+    except Exception as e:
+        print(f"[CHECKPOINT IGNORED - {e!r}] {path}")
+        return None
+
+
+def delete() -> None:
+    path.unlink(missing_ok=True)
@@ -2,8 +2,12 @@ from argparse import ArgumentParser
 from pathlib import Path
 from textwrap import dedent
 
+import api
+import persistence
 from dump import dump
 from scan import scan
+from search import search
+from stats import stats
 
 directory = Path(__file__).parent
 
@@ -11,14 +15,72 @@ parser = ArgumentParser()
 parser.add_argument(
     "program",
     type=str,
-    choices=["scan", "dump"],
+    choices=["scan", "dump", "search", "stats"],
     default="scan",
     nargs="?",
     help=dedent(
         """
             The program which should be run:
-                scan: Create database schemas, if they don't already exist.
-                backfill: Fetch all calls from CallRail and fill the database.
+                scan: Pair elements and save the results into the database.
+                dump: Print a script which adds every known element to your browser.
+                search: Find known elements by name, and show the recipe which produced them.
+                stats: Show totals and the top elements from the element statistics table.
+        """,
+    ).strip(),
+)
+parser.add_argument(
+    "query",
+    type=str,
+    nargs="?",
+    help=dedent(
+        """
+            The element name to look for, used by the `search` program.
+            If not specified, you will be prompted for it.
+        """,
+    ).strip(),
+)
+parser.add_argument(
+    "--match",
+    type=str,
+    choices=persistence.SEARCH_MODES,
+    default=persistence.SEARCH_MODES[0],
+    help=dedent(
+        """
+            How the `search` program should match element names:
+                ranked: Exact matches first, then prefix matches, then the best substring matches (for 3+ characters).
+                prefix: Names starting with the query, alphabetically.
+                substring: Names containing the query, oldest first. Slow for queries under 3 characters.
+        """,
+    ).strip(),
+)
+parser.add_argument(
+    "--limit",
+    type=int,
+    default=20,
+    help=dedent(
+        """
+            Maximum number of results shown by the `search` and `stats` programs.
+        """,
+    ).strip(),
+)
+parser.add_argument(
+    "--sort",
+    type=str,
+    choices=persistence.ELEMENT_STATS_ORDERS,
+    default=persistence.ELEMENT_STATS_ORDERS[0],
+    help=dedent(
+        """
+            Which statistic the `stats` program should rank elements by (highest first).
+        """,
+    ).strip(),
+)
+parser.add_argument(
+    "--rebuild",
+    action="store_true",
+    help=dedent(
+        """
+            Recompute the element statistics table from scratch before the `stats` program reports on it.
+            This is only needed if the database was modified by something other than this program.
         """,
     ).strip(),
 )
@@ -27,7 +89,7 @@ parser.add_argument(
     action="store_true",
     help=dedent(
         """
-            If not specified, the program will not bother pairing two elements which are both more than 50% numeric.
+            If not specified, the program will not bother pairing two elements which are both more than 50%% numeric.
             This useful since those pairings _usually_ just result in a bigger number, which is entirely uninteresting
             (regardless of the fact that it's almost always a New Discovery).
         """,
@@ -55,11 +117,71 @@ parser.add_argument(
         """,
     ).strip(),
 )
+parser.add_argument(
+    "--request-timeout",
+    type=float,
+    default=5,
+    help=dedent(
+        """
+            How long a single request may take before it is abandoned (and possibly retried).
+        """,
+    ).strip(),
+)
+parser.add_argument(
+    "--retry-policy",
+    type=api.parse_retry_policy,
+    action="append",
+    default=[],
+    metavar="CLASS=DEADLINE[,BACKOFF[,MAX_BACKOFF]]",
+    help=dedent(
+        f"""
+            How failed requests are retried, per class of error ({", ".join(api.ERROR_CLASSES)}).
+            A pair is retried after BACKOFF seconds, doubling up to MAX_BACKOFF, until DEADLINE seconds have
+            passed since its first attempt. Retries wait in a queue, so they never block a thread.
+            May be given multiple times. Defaults: {"  ".join(f"{k}={v}" for k, v in api.RETRY_POLICIES.items())}
+        """,
+    ).strip(),
+)
+parser.add_argument(
+    "--checkpoint-interval",
+    type=float,
+    default=30,
+    help=dedent(
+        """
+            How often (in seconds) the `scan` program saves its queued, retrying and failed pairs,
+            so that it can pick up where it left off when restarted. It also saves them when stopped.
+        """,
+    ).strip(),
+)
+parser.add_argument(
+    "--fresh",
+    action="store_true",
+    help=dedent(
+        """
+            Ignore the checkpoint saved by a previous `scan`, instead of resuming from it.
+        """,
+    ).strip(),
+)
 
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    if args.query is not None and args.program != "search":
+        parser.error(f"the `{args.program}` program does not take a query")
+
     if args.program == "scan":
-        scan(args.allow_numbers, args.seconds_per_request, args.threads)
+        scan(
+            args.allow_numbers,
+            args.seconds_per_request,
+            args.threads,
+            request_timeout=args.request_timeout,
+            retry_policies=dict(args.retry_policy),
+            checkpoint_interval=args.checkpoint_interval,
+            resume_checkpoint=not args.fresh,
+        )
     elif args.program == "dump":
         dump()
+    elif args.program == "search":
+        search(args.query or input("Search: "), args.match, args.limit)
+    elif args.program == "stats":
+        stats(args.sort, args.limit, args.rebuild)
@@ -75,3 +75,37 @@ class Pair(PendingPair):
     @property
     def elements(self) -> tuple[Element, Element, Element]:
         return self.first, self.second, self.result
+
+
+class ElementStats:
+    def __init__(
+        self,
+        element: Element,
+        fan_in: int = 0,
+        fan_out: int = 0,
+        nothing_count: int = 0,
+        discovery_count: int = 0,
+        first_seen_depth: int | None = None,
+    ) -> None:
+        self.element = element
+        self.fan_in = fan_in
+        self.fan_out = fan_out
+        self.nothing_count = nothing_count
+        self.discovery_count = discovery_count
+        self.first_seen_depth = first_seen_depth
+
+    def __str__(self) -> str:
+        depth = "?" if self.first_seen_depth is None else self.first_seen_depth
+        return (
+            f"{self.element}"
+            f" (made by {self.fan_in:,d}, used in {self.fan_out:,d},"
+            f" {self.nothing_count:,d} Nothing, {self.discovery_count:,d} discoveries,"
+            f" depth {depth})"
+        )
+
+    def __repr__(self) -> str:
+        return repr(str(self))
+
+    @property
+    def discovery_yield(self) -> float:
+        return self.discovery_count / self.fan_out if self.fan_out else 0.0
@@ -2,7 +2,7 @@ import random
 import sqlite3
 from typing import Generator, Literal
 
-from models import Element, Pair, PendingPair
+from models import Element, ElementStats, Pair, PendingPair
 
 
 def connect() -> sqlite3.Connection:
@@ -38,6 +38,80 @@ with connect() as conn:
         """,
     )
 
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS element_name_nocase
+        ON element (name COLLATE NOCASE)
+        """,
+    )
+
+    # superseded by the index below, which also covers the recipe lookup in `_search_elements`
+    conn.execute("DROP INDEX IF EXISTS pair_result_element_id")
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS pair_result_element_id_discovery
+        ON pair (result_element_id, is_discovery DESC, id)
+        """,
+    )
+
+    # Trigram index over element names so that substring searches don't need to
+    # scan the whole element table. It's kept in sync by `_upsert_element`.
+    (has_element_search,) = conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE name = 'element_search'",
+    ).fetchone()
+
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS element_search
+        USING fts5(name, tokenize = 'trigram')
+        """,
+    )
+
+    if not has_element_search:
+        # databases created before the index existed need to be backfilled once
+        conn.execute(
+            """
+            INSERT INTO element_search (rowid, name)
+            SELECT id, name FROM element
+            """,
+        )
+
+    # Per-element aggregates, maintained by `_upsert_pair` so that reports don't
+    # need to aggregate over the entire pair table.
+    (has_element_stats,) = conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE name = 'element_stats'",
+    ).fetchone()
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS element_stats (
+            element_id INTEGER PRIMARY KEY,
+            fan_in INTEGER NOT NULL DEFAULT 0,
+            fan_out INTEGER NOT NULL DEFAULT 0,
+            nothing_count INTEGER NOT NULL DEFAULT 0,
+            discovery_count INTEGER NOT NULL DEFAULT 0,
+            first_seen_depth INTEGER,
+            FOREIGN KEY (element_id) REFERENCES element (id)
+        )
+        """,
+    )
+
+    for column in ("fan_in", "fan_out", "nothing_count", "discovery_count", "first_seen_depth"):
+        conn.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS element_stats_{column}
+            ON element_stats ({column})
+            """,
+        )
+
+    # must match the `discovery_yield` ordering in `_select_element_stats` exactly
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS element_stats_discovery_yield
+        ON element_stats (CAST(discovery_count AS REAL) / MAX(fan_out, 1), fan_out)
+        """,
+    )
+
 
 def _upsert_element(conn: sqlite3.Connection, element: Element) -> None:
     conn.execute(
@@ -55,6 +129,20 @@ def _upsert_element(conn: sqlite3.Connection, element: Element) -> None:
         (element.name,),
     ).fetchone()
 
+    conn.execute(
+        """
+        INSERT INTO element_search (rowid, name)
+        SELECT ?1, ?2
+        WHERE NOT EXISTS (SELECT 1 FROM element_search WHERE rowid = ?1)
+        """,
+        (element.database_id, element.name),
+    )
+
+    conn.execute(
+        "INSERT OR IGNORE INTO element_stats (element_id) VALUES (?)",
+        (element.database_id,),
+    )
+
 
 def _upsert_pair(conn: sqlite3.Connection, pair: Pair) -> None:
     # first, insert the elements:
@@ -64,6 +152,26 @@ def _upsert_pair(conn: sqlite3.Connection, pair: Pair) -> None:
 
         _upsert_element(conn, element)
 
+    # undo the stats contributed by the previous result, if this pair was already recorded:
+    previous = conn.execute(
+        """
+        SELECT result.name, pair.is_discovery
+        FROM pair
+        JOIN element result ON result.id = pair.result_element_id
+        WHERE pair.first_element_id = ? AND pair.second_element_id = ?
+        """,
+        (pair.first.database_id, pair.second.database_id),
+    ).fetchone()
+    if previous is not None:
+        previous_name, previous_is_discovery = previous
+        _update_element_stats(
+            conn,
+            pair,
+            -1,
+            is_nothing=previous_name.lower() == "nothing",
+            is_discovery=previous_is_discovery == 1,
+        )
+
     # now, record the pair:
     conn.execute(
         """
@@ -76,6 +184,148 @@ def _upsert_pair(conn: sqlite3.Connection, pair: Pair) -> None:
         (*(e.database_id for e in pair.elements), 1 if pair.is_discovery else 0),
     )
 
+    # `is_discovery` is sticky in the upsert above, so re-read the stored value:
+    (is_discovery,) = conn.execute(
+        "SELECT is_discovery FROM pair WHERE first_element_id = ? AND second_element_id = ?",
+        (pair.first.database_id, pair.second.database_id),
+    ).fetchone()
+    _update_element_stats(
+        conn,
+        pair,
+        1,
+        is_nothing=pair.result.name.lower() == "nothing",
+        is_discovery=is_discovery == 1,
+    )
+
+
+def _update_element_stats(
+    conn: sqlite3.Connection,
+    pair: Pair,
+    delta: Literal[1, -1],
+    *,
+    is_nothing: bool,
+    is_discovery: bool,
+) -> None:
+    ingredient_ids = {pair.first.database_id, pair.second.database_id}
+    for ingredient_id in ingredient_ids:
+        conn.execute(
+            """
+            UPDATE element_stats SET
+            fan_out = fan_out + ?,
+            nothing_count = nothing_count + ?,
+            discovery_count = discovery_count + ?
+            WHERE element_id = ?
+            """,
+            (delta, delta * is_nothing, delta * is_discovery, ingredient_id),
+        )
+
+    if delta < 0:
+        # the previous result keeps its depth, since it was still seen at that depth
+        conn.execute(
+            """
+            UPDATE element_stats SET fan_in = fan_in - 1
+            WHERE element_id = (
+                SELECT result_element_id
+                FROM pair
+                WHERE first_element_id = ? AND second_element_id = ?
+            )
+            """,
+            (pair.first.database_id, pair.second.database_id),
+        )
+        return
+
+    conn.execute(
+        """
+        UPDATE element_stats SET
+        fan_in = fan_in + 1,
+        first_seen_depth = COALESCE(
+            MIN(first_seen_depth, ingredients.depth),
+            first_seen_depth,
+            ingredients.depth
+        )
+        FROM (
+            SELECT MAX(first_seen_depth) + 1 AS depth
+            FROM element_stats
+            WHERE element_id IN (?, ?)
+        ) AS ingredients
+        WHERE element_id = ?
+        """,
+        (pair.first.database_id, pair.second.database_id, pair.result.database_id),
+    )
+
+
+def _rebuild_element_stats(conn: sqlite3.Connection) -> None:
+    conn.execute("DELETE FROM element_stats")
+    conn.execute("INSERT INTO element_stats (element_id) SELECT id FROM element")
+    conn.execute(
+        """
+        UPDATE element_stats SET
+        fan_out = ingredients.fan_out,
+        nothing_count = ingredients.nothing_count,
+        discovery_count = ingredients.discovery_count
+        FROM (
+            SELECT
+                ingredient_id,
+                COUNT(*) AS fan_out,
+                SUM(lower(result.name) = 'nothing') AS nothing_count,
+                SUM(is_discovery = 1) AS discovery_count
+            FROM (
+                SELECT first_element_id AS ingredient_id, result_element_id, is_discovery
+                FROM pair
+                UNION ALL
+                SELECT second_element_id, result_element_id, is_discovery
+                FROM pair
+                WHERE second_element_id != first_element_id
+            )
+            JOIN element result ON result.id = result_element_id
+            GROUP BY ingredient_id
+        ) AS ingredients
+        WHERE element_id = ingredients.ingredient_id
+        """,
+    )
+    conn.execute(
+        """
+        UPDATE element_stats SET fan_in = results.fan_in
+        FROM (
+            SELECT result_element_id, COUNT(*) AS fan_in
+            FROM pair
+            GROUP BY result_element_id
+        ) AS results
+        WHERE element_id = results.result_element_id
+        """,
+    )
+
+    # Replay the pairs in the order they were first recorded, the same way `_update_element_stats`
+    # would have seen them. Only the current result of each pair is known though, so if pairs were
+    # re-recorded with a different result, depths may differ from the incremental ones, which also
+    # remember results that have since been replaced.
+    depths: dict[int, int] = {
+        element_id: 0
+        for (element_id,) in conn.execute(
+            f"SELECT id FROM element WHERE name IN ({', '.join('?' * len(primary_elements))})",
+            [e.name for e in primary_elements],
+        )
+    }
+    for first_id, second_id, result_id in conn.execute(
+        "SELECT first_element_id, second_element_id, result_element_id FROM pair ORDER BY id",
+    ):
+        ingredient_depths = [depths[i] for i in (first_id, second_id) if i in depths]
+        if not ingredient_depths:
+            continue
+
+        depth = max(ingredient_depths) + 1
+        depths[result_id] = min(depths.get(result_id, depth), depth)
+
+    conn.executemany(
+        "UPDATE element_stats SET first_seen_depth = ? WHERE element_id = ?",
+        ((depth, element_id) for element_id, depth in depths.items()),
+    )
+
+
+def rebuild_element_stats() -> None:
+    with connect() as conn:
+        _rebuild_element_stats(conn)
+
 
 def record_pair(pair: Pair) -> None:
     with connect() as conn:
@@ -129,6 +379,45 @@ def select_pending_pairs(order: PendingPairOrder) -> Generator[PendingPair, None
         yield from _select_pending_pairs(conn, order)
 
 
+def _select_recorded_pairs(
+    conn: sqlite3.Connection,
+    pending_pairs: list[PendingPair],
+) -> set[PendingPair]:
+    return {
+        pending_pair
+        for pending_pair in pending_pairs
+        if conn.execute(
+            "SELECT 1 FROM pair WHERE first_element_id = ? AND second_element_id = ?",
+            (pending_pair.first.database_id, pending_pair.second.database_id),
+        ).fetchone()
+    }
+
+
+def select_recorded_pairs(pending_pairs: list[PendingPair]) -> set[PendingPair]:
+    with connect() as conn:
+        return _select_recorded_pairs(conn, pending_pairs)
+
+
+def _select_elements_by_name(
+    conn: sqlite3.Connection,
+    names: set[str],
+) -> dict[str, Element]:
+    elements = {}
+    for name in names:
+        row = conn.execute(
+            "SELECT name, emoji, id FROM element WHERE name = ?",
+            (name,),
+        ).fetchone()
+        if row is not None:
+            elements[name] = Element(*row)
+    return elements
+
+
+def select_elements_by_name(names: set[str]) -> dict[str, Element]:
+    with connect() as conn:
+        return _select_elements_by_name(conn, names)
+
+
 def _element_count(conn: sqlite3.Connection) -> int:
     (count,) = conn.execute("SELECT COUNT(*) FROM element").fetchone()
     return count
@@ -174,6 +463,233 @@ def select_elements_and_discovered() -> Generator[tuple[Element, bool], None, No
         return _select_elements_and_discovered(conn)
 
 
+SearchMode = Literal["ranked", "prefix", "substring"]
+SEARCH_MODES: list[SearchMode] = ["ranked", "prefix", "substring"]
+
+
+def _exact_element_ids(conn: sqlite3.Connection, query: str) -> list[int]:
+    result = conn.execute(
+        "SELECT id FROM element WHERE name = ? COLLATE NOCASE",
+        (query,),
+    )
+    return [element_id for (element_id,) in result]
+
+
+def _prefix_element_ids(conn: sqlite3.Connection, query: str, limit: int) -> list[int]:
+    # a range over the case-insensitive name index, since every name starting with
+    # the query sorts between the query itself and the query followed by the largest character
+    result = conn.execute(
+        """
+        SELECT id
+        FROM element
+        WHERE name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE
+        ORDER BY name COLLATE NOCASE
+        LIMIT ?
+        """,
+        (query, query + "\U0010ffff", limit),
+    )
+    return [element_id for (element_id,) in result]
+
+
+def _substring_element_ids(
+    conn: sqlite3.Connection,
+    query: str,
+    limit: int,
+    *,
+    ranked: bool = False,
+) -> list[int]:
+    if len(query) >= 3:
+        result = conn.execute(
+            f"""
+            SELECT rowid
+            FROM element_search
+            WHERE element_search MATCH ?
+            ORDER BY {"rank" if ranked else "rowid"}
+            LIMIT ?
+            """,
+            ('"' + query.replace('"', '""') + '"', limit),
+        )
+    else:
+        # the trigram tokenizer can only use its index for queries of 3+ characters,
+        # but short substrings are common enough that a scan finds `limit` of them quickly
+        result = conn.execute(
+            """
+            SELECT id
+            FROM element
+            WHERE instr(lower(name), lower(?)) > 0
+            ORDER BY id
+            LIMIT ?
+            """,
+            (query, limit),
+        )
+    return [element_id for (element_id,) in result]
+
+
+def _search_element_ids(
+    conn: sqlite3.Connection,
+    query: str,
+    mode: SearchMode,
+    limit: int,
+) -> list[int]:
+    if mode == "prefix":
+        return _prefix_element_ids(conn, query, limit)
+    if mode == "substring":
+        return _substring_element_ids(conn, query, limit)
+
+    # ranked: exact matches, then prefix matches, then the best substring matches
+    # (only when the trigram index can find them, since otherwise it's a full scan)
+    element_ids = _exact_element_ids(conn, query)
+    if len(element_ids) < limit:
+        element_ids += _prefix_element_ids(conn, query, limit)
+    if len(element_ids) < limit and len(query) >= 3:
+        element_ids += _substring_element_ids(conn, query, 2 * limit, ranked=True)
+
+    return list(dict.fromkeys(element_ids))[:limit]
+
+
+def _search_elements(
+    conn: sqlite3.Connection,
+    query: str,
+    mode: SearchMode = SEARCH_MODES[0],
+    limit: int = 20,
+) -> Generator[tuple[Element, Pair | None], None, None]:
+    element_ids = _search_element_ids(conn, query, mode, limit)
+    if not element_ids:
+        return
+
+    # only look up recipes for the elements which are actually shown
+    result = conn.execute(
+        f"""
+        SELECT
+            e.name,
+            e.emoji,
+            e.id,
+            first.name,
+            first.emoji,
+            first.id,
+            second.name,
+            second.emoji,
+            second.id,
+            p.is_discovery
+        FROM element e
+        LEFT JOIN pair p ON p.id = (
+            SELECT id
+            FROM pair
+            WHERE result_element_id = e.id
+            ORDER BY is_discovery DESC, id ASC
+            LIMIT 1
+        )
+        LEFT JOIN element first ON first.id = p.first_element_id
+        LEFT JOIN element second ON second.id = p.second_element_id
+        WHERE e.id IN ({", ".join("?" * len(element_ids))})
+        """,
+        element_ids,
+    )
+
+    rows = {row[2]: row for row in result}
+    for element_id in element_ids:
+        row = rows[element_id]
+        element = Element(*row[0:3])
+        if row[9] is None:
+            yield element, None
+            continue
+
+        yield element, Pair(
+            Element(*row[3:6]),
+            Element(*row[6:9]),
+            element,
+            row[9] == 1,
+        )
+
+
+def search_elements(
+    query: str,
+    mode: SearchMode = SEARCH_MODES[0],
+    limit: int = 20,
+) -> Generator[tuple[Element, Pair | None], None, None]:
+    with connect() as conn:
+        yield from _search_elements(conn, query, mode, limit)
+
+
+ElementStatsOrder = Literal[
+    "fan_in",
+    "fan_out",
+    "nothing_count",
+    "discovery_count",
+    "discovery_yield",
+    "first_seen_depth",
+]
+ELEMENT_STATS_ORDERS: list[ElementStatsOrder] = [
+    "discovery_count",
+    "discovery_yield",
+    "fan_in",
+    "fan_out",
+    "nothing_count",
+    "first_seen_depth",
+]
+
+
+def _select_element_stats(
+    conn: sqlite3.Connection,
+    order: ElementStatsOrder = ELEMENT_STATS_ORDERS[0],
+    limit: int = 20,
+) -> Generator[ElementStats, None, None]:
+    if order == "discovery_yield":
+        order_by = "CAST(discovery_count AS REAL) / MAX(fan_out, 1) DESC, fan_out DESC"
+    else:
+        order_by = f"s.{order} DESC"
+
+    result = conn.execute(
+        f"""
+        SELECT
+            e.name,
+            e.emoji,
+            e.id,
+            s.fan_in,
+            s.fan_out,
+            s.nothing_count,
+            s.discovery_count,
+            s.first_seen_depth
+        FROM element_stats s
+        JOIN element e ON e.id = s.element_id
+        ORDER BY {order_by}
+        LIMIT ?
+        """,
+        (limit,),
+    )
+
+    for row in result:
+        yield ElementStats(Element(*row[0:3]), *row[3:])
+
+
+def select_element_stats(
+    order: ElementStatsOrder = ELEMENT_STATS_ORDERS[0],
+    limit: int = 20,
+) -> Generator[ElementStats, None, None]:
+    with connect() as conn:
+        yield from _select_element_stats(conn, order, limit)
+
+
+def _element_stats_totals(conn: sqlite3.Connection) -> tuple[int, int, int, int | None]:
+    elements, pairs, max_depth = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(fan_in), 0), MAX(first_seen_depth) FROM element_stats",
+    ).fetchone()
+    (nothing_pairs,) = conn.execute(
+        """
+        SELECT COALESCE(SUM(s.fan_in), 0)
+        FROM element e
+        JOIN element_stats s ON s.element_id = e.id
+        WHERE e.name = 'nothing' COLLATE NOCASE
+        """,
+    ).fetchone()
+    return elements, pairs, nothing_pairs, max_depth
+
+
+def element_stats_totals() -> tuple[int, int, int, int | None]:
+    with connect() as conn:
+        return _element_stats_totals(conn)
+
+
 with connect() as conn:
     primary_elements = [
         Element("Fire", "\N{FIRE}"),
@@ -189,3 +705,11 @@ with connect() as conn:
 
     for e in primary_elements:
         _upsert_element(conn, e)
+        conn.execute(
+            "UPDATE element_stats SET first_seen_depth = 0 WHERE element_id = ?",
+            (e.database_id,),
+        )
+
+    if not has_element_stats:
+        # databases created before the stats table existed need to be backfilled once
+        _rebuild_element_stats(conn)
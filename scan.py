@@ -1,8 +1,12 @@
+import heapq
+import itertools
 import time
+from collections import deque
 from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from typing import Generator, TypeAlias
 
 import api
+import checkpoint
 import cloudflare
 import persistence
 from models import Pair, PendingPair
@@ -10,6 +14,35 @@ from models import Pair, PendingPair
 Failed: TypeAlias = set[PendingPair]
 Futures: TypeAlias = dict[Future[Pair], PendingPair]
 Headers: TypeAlias = dict[str, str]
+# the next few pending pairs to request, so that the database isn't queried for every single one
+Candidates: TypeAlias = deque[PendingPair]
+# pairs restored from a checkpoint (or cancelled on shutdown), which are requested before any candidates
+Resumed: TypeAlias = deque[PendingPair]
+# min-heap of (time at which to retry, tiebreaker, pending pair)
+Retries: TypeAlias = list[tuple[float, int, PendingPair]]
+RetryPolicies: TypeAlias = dict[api.ErrorClass, api.RetryPolicy]
+
+retry_tiebreaker = itertools.count()
+
+
+class Attempt:
+    def __init__(self) -> None:
+        self.count = 0
+        # Set by the worker which starts the first attempt (see `attempt_pair`), rather than when
+        # the pair is queued, so that time spent waiting for a free thread isn't held against it.
+        self.started_at: float | None = None
+        # Set when a retry is scheduled, so that the retry can't outlive the policy's deadline.
+        self.deadline_at: float | None = None
+
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            msg = "The first attempt hasn't started yet"
+            raise RuntimeError(msg)
+
+        return now() - self.started_at
+
+
+Attempts: TypeAlias = dict[PendingPair, Attempt]
 
 
 def valid_pending_pairs(
@@ -17,6 +50,8 @@ def valid_pending_pairs(
     *,
     failed: Failed,
     futures: Futures,
+    resumed: Resumed,
+    attempts: Attempts,
     order: persistence.PendingPairOrder,
 ) -> Generator[PendingPair, None, None]:
     for pending_pair in persistence.select_pending_pairs(order):
@@ -29,6 +64,12 @@ def valid_pending_pairs(
         if pending_pair in futures.values():
             continue
 
+        if pending_pair in resumed:
+            continue
+
+        if pending_pair in attempts:
+            continue  # waiting in the retry queue
+
         yield pending_pair
 
 
@@ -37,42 +78,170 @@ def queue_pair(
     pending_pair: PendingPair,
     futures: Futures,
     *,
+    attempts: Attempts,
     headers: Headers,
+    request_timeout: float,
 ) -> None:
+    attempts.setdefault(pending_pair, Attempt()).count += 1
+
     futures[
         executor.submit(
-            api.make_pair_exp_backoff,
+            attempt_pair,
             pending_pair,
             headers,
-            timeout=5,
+            attempts=attempts,
+            request_timeout=request_timeout,
         )
     ] = pending_pair
 
 
+def attempt_pair(
+    pending_pair: PendingPair,
+    headers: Headers,
+    *,
+    attempts: Attempts,
+    request_timeout: float,
+) -> Pair:
+    # runs in a worker thread
+    attempt = attempts[pending_pair]
+    if attempt.started_at is None:
+        attempt.started_at = now()
+
+    timeout = request_timeout
+    if attempt.deadline_at is not None:
+        timeout = min(timeout, attempt.deadline_at - now())
+        if timeout <= 0:
+            msg = f"Ran out of time while making the pair: {pending_pair}"
+            raise TimeoutError(msg)
+
+    return api.make_pair(pending_pair, headers, timeout=timeout)
+
+
 def push_one_future(
     executor: ThreadPoolExecutor,
     futures: Futures,
     *,
     allow_numbers: bool,
+    resumed: Resumed,
+    candidates: Candidates,
     failed: Failed,
+    attempts: Attempts,
+    retries: Retries,
     headers: Headers,
+    request_timeout: float,
     order: persistence.PendingPairOrder,
 ) -> bool:
-    for pending_pair in valid_pending_pairs(
-        allow_numbers,
-        failed=failed,
-        futures=futures,
-        order=order,
-    ):
-        queue_pair(executor, pending_pair, futures, headers=headers)
+    if retries and retries[0][0] <= now():
+        _, _, pending_pair = heapq.heappop(retries)
+        queue_pair(
+            executor,
+            pending_pair,
+            futures,
+            attempts=attempts,
+            headers=headers,
+            request_timeout=request_timeout,
+        )
         return True
-    return False
+
+    while resumed:
+        pending_pair = resumed.popleft()
+        if pending_pair in failed or pending_pair in attempts:
+            continue
+
+        queue_pair(
+            executor,
+            pending_pair,
+            futures,
+            attempts=attempts,
+            headers=headers,
+            request_timeout=request_timeout,
+        )
+        return True
+
+    while True:
+        if not candidates:
+            refill_candidates(
+                allow_numbers,
+                resumed=resumed,
+                candidates=candidates,
+                failed=failed,
+                futures=futures,
+                attempts=attempts,
+                order=order,
+            )
+            if not candidates:
+                return False
+
+        pending_pair = candidates.popleft()
+        if pending_pair in failed or pending_pair in attempts:
+            continue
+
+        queue_pair(
+            executor,
+            pending_pair,
+            futures,
+            attempts=attempts,
+            headers=headers,
+            request_timeout=request_timeout,
+        )
+        return True
+
+
+def refill_candidates(
+    allow_numbers: bool,
+    *,
+    resumed: Resumed,
+    candidates: Candidates,
+    failed: Failed,
+    futures: Futures,
+    attempts: Attempts,
+    order: persistence.PendingPairOrder,
+    lookahead: int = 32,
+) -> None:
+    batch = list(
+        itertools.islice(
+            valid_pending_pairs(
+                allow_numbers,
+                failed=failed,
+                futures=futures,
+                resumed=resumed,
+                attempts=attempts,
+                order=order,
+            ),
+            lookahead,
+        ),
+    )
+
+    # replace, rather than extend, since the order may have changed since the last batch
+    candidates.clear()
+    candidates.extend(batch)
+
+
+def schedule_retry(
+    pending_pair: PendingPair,
+    exc: Exception,
+    *,
+    attempts: Attempts,
+    retries: Retries,
+    retry_policies: RetryPolicies,
+) -> float | None:
+    attempt = attempts[pending_pair]
+    policy = retry_policies[api.classify_error(exc)]
+    elapsed = attempt.elapsed()
+    delay = policy.delay(attempt.count, elapsed)
+    if delay is not None:
+        attempt.deadline_at = now() - elapsed + policy.deadline
+        heapq.heappush(retries, (now() + delay, next(retry_tiebreaker), pending_pair))
+    return delay
 
 
 def handle_completed_futures(
     futures: Futures,
     *,
     failed: Failed,
+    attempts: Attempts,
+    retries: Retries,
+    retry_policies: RetryPolicies,
     timeout: float,
 ) -> Generator[Pair | None, None, None]:
     n_elements, n_pairs = persistence.counts()
@@ -82,19 +251,31 @@ def handle_completed_futures(
         pending_pair = futures.pop(future)
         try:
             pair = future.result()
-        except TimeoutError:
-            print(f"[API TIMED OUT] {pending_pair}".ljust(len(log_line)))
-            print(log_line, end="\r")
-            failed.add(pending_pair)
-            yield None
-            continue
         except Exception as e:
-            print(f"[API FAILED - {e!r}] {pending_pair}".ljust(len(log_line)))
+            delay = schedule_retry(
+                pending_pair,
+                e,
+                attempts=attempts,
+                retries=retries,
+                retry_policies=retry_policies,
+            )
+            if delay is not None:
+                print(f"[API RETRYING in {delay:g}s - {e!r}] {pending_pair}".ljust(len(log_line)))
+                print(log_line, end="\r")
+                continue
+
+            del attempts[pending_pair]
+            if api.classify_error(e) == "timeout":
+                print(f"[API TIMED OUT] {pending_pair}".ljust(len(log_line)))
+            else:
+                print(f"[API FAILED - {e!r}] {pending_pair}".ljust(len(log_line)))
             print(log_line, end="\r")
             failed.add(pending_pair)
             yield None
             continue
 
+        del attempts[pending_pair]
+
         try:
             persistence.record_pair(pair)
         except Exception as e:
@@ -117,76 +298,259 @@ def now() -> float:
     return time.perf_counter()
 
 
-def scan(allow_numbers: bool, seconds_per_request: float, threads: int) -> None:
+def make_checkpoint(
+    futures: Futures,
+    *,
+    resumed: Resumed,
+    candidates: Candidates,
+    failed: Failed,
+    attempts: Attempts,
+    retries: Retries,
+    orders: list[persistence.PendingPairOrder],
+) -> checkpoint.Checkpoint:
+    return checkpoint.Checkpoint(
+        orders.copy(),
+        [*futures.values(), *resumed, *candidates],
+        [
+            (
+                pending_pair,
+                max(retry_at - now(), 0),
+                attempts[pending_pair].count,
+                attempts[pending_pair].elapsed(),
+                deadline_in(attempts[pending_pair]),
+            )
+            for retry_at, _, pending_pair in sorted(retries)
+        ],
+        list(failed),
+    )
+
+
+def deadline_in(attempt: Attempt) -> float | None:
+    return None if attempt.deadline_at is None else attempt.deadline_at - now()
+
+
+def resume(
+    allow_numbers: bool,
+    *,
+    resumed: Resumed,
+    failed: Failed,
+    attempts: Attempts,
+    retries: Retries,
+    orders: list[persistence.PendingPairOrder],
+) -> None:
+    saved = checkpoint.load()
+    if saved is None:
+        return
+
+    # The checkpoint only has element names, since it may belong to a different database
+    # (e.g. one downloaded from the releases). Look the elements up again, and skip any pairs
+    # whose elements don't exist here.
+    elements = persistence.select_elements_by_name(
+        {
+            element.name
+            for pending_pair in [*saved.candidates, *(r[0] for r in saved.retries)]
+            for element in (pending_pair.first, pending_pair.second)
+        },
+    )
+
+    def lookup(pending_pair: PendingPair) -> PendingPair | None:
+        first = elements.get(pending_pair.first.name)
+        second = elements.get(pending_pair.second.name)
+        if first is None or second is None:
+            return None
+        return PendingPair(first, second)
+
+    saved_candidates = [p for p in map(lookup, saved.candidates) if p is not None]
+    saved_retries = [
+        (found, delay, n_attempts, elapsed, deadline)
+        for pending_pair, delay, n_attempts, elapsed, deadline in saved.retries
+        if (found := lookup(pending_pair)) is not None
+    ]
+
+    # the checkpoint may be older than the database, e.g. if the program crashed
+    recorded = persistence.select_recorded_pairs(
+        [*saved_candidates, *(r[0] for r in saved_retries)],
+    )
+
+    def wanted(pending_pair: PendingPair) -> bool:
+        if not allow_numbers and pending_pair.numeric:
+            return False
+        return pending_pair not in recorded and pending_pair not in attempts
+
+    orders[:] = saved.orders
+    failed.update(saved.failed)
+
+    for pending_pair, delay, n_attempts, elapsed, deadline in saved_retries:
+        if not wanted(pending_pair):
+            continue
+
+        attempt = attempts[pending_pair] = Attempt()
+        attempt.count = n_attempts
+        attempt.started_at = now() - elapsed
+        attempt.deadline_at = None if deadline is None else now() + deadline
+        heapq.heappush(retries, (now() + delay, next(retry_tiebreaker), pending_pair))
+
+    for pending_pair in saved_candidates:
+        if wanted(pending_pair) and pending_pair not in resumed:
+            resumed.append(pending_pair)
+
+    print(
+        f"[RESUMED] {len(resumed)} queued, {len(retries)} retrying,"
+        f" and {len(failed)} failed pair(s) from {checkpoint.path}",
+    )
+
+
+def scan(
+    allow_numbers: bool,
+    seconds_per_request: float,
+    threads: int,
+    *,
+    request_timeout: float = 5,
+    retry_policies: RetryPolicies | None = None,
+    checkpoint_interval: float = 30,
+    resume_checkpoint: bool = True,
+) -> None:
     threads = max(threads, 1)
+    retry_policies = {**api.RETRY_POLICIES, **(retry_policies or {})}
 
     headers: Headers = cloudflare.get_headers()
     failed: Failed = set()
     futures: Futures = {}
+    resumed: Resumed = deque()
+    candidates: Candidates = deque()
+    attempts: Attempts = {}
+    retries: Retries = []
 
     orders = persistence.PENDING_PAIR_ORDERS.copy()
 
+    if resume_checkpoint:
+        resume(
+            allow_numbers,
+            resumed=resumed,
+            failed=failed,
+            attempts=attempts,
+            retries=retries,
+            orders=orders,
+        )
+
+    def save_checkpoint() -> None:
+        checkpoint.save(
+            make_checkpoint(
+                futures,
+                resumed=resumed,
+                candidates=candidates,
+                failed=failed,
+                attempts=attempts,
+                retries=retries,
+                orders=orders,
+            ),
+        )
+
     with ThreadPoolExecutor(threads) as executor:
 
         def shutdown() -> None:
             executor.shutdown(False, cancel_futures=True)
+
+            # cancelled futures never started, so just request them first next time
+            for future, pending_pair in list(futures.items()):
+                if future.cancelled():
+                    del futures[future]
+                    del attempts[pending_pair]
+                    resumed.appendleft(pending_pair)
+
             incomplete_futures = [f for f in futures if not f.done()]
-            if not incomplete_futures:
-                return
-
-            n = len(incomplete_futures)
-
-            before = time.perf_counter()
-            print(f"[SHUTTING DOWN] 0/{n} threads terminated...", end="\r")
-            for i, _ in enumerate(as_completed(incomplete_futures), 1):
-                print(f"[SHUTTING DOWN] {i}/{n} threads terminated...", end="\r")
-            duration = 1000 * (time.perf_counter() - before)
-            print(f"[SHUTDOWN] {n} thread(s) completed in {duration:.2f} milliseconds.")
-
-        while True:
-            if len(futures) < threads * 2:
-                pushed = push_one_future(
-                    executor,
-                    futures,
-                    allow_numbers=allow_numbers,
-                    failed=failed,
-                    headers=headers,
-                    order=orders[0],
-                )
-
-                if not pushed:
-                    if failed:
-                        failed.clear()
-                        continue
-
-                    if not futures:
-                        print("Completed! All possible pairs have been made!")
-                        return
-
-            next_future_at = now() + seconds_per_request
-            try:
-                for pair in handle_completed_futures(
-                    futures,
-                    failed=failed,
-                    timeout=next_future_at - now(),
-                ):
-                    if not pair or pair.result.name.lower() == "nothing":
-                        orders.insert(0, orders.pop())
-            except TimeoutError:
+            if incomplete_futures:
+                n = len(incomplete_futures)
+
+                before = time.perf_counter()
+                print(f"[SHUTTING DOWN] 0/{n} threads terminated...", end="\r")
+                for i, _ in enumerate(as_completed(incomplete_futures), 1):
+                    print(f"[SHUTTING DOWN] {i}/{n} threads terminated...", end="\r")
+                duration = 1000 * (time.perf_counter() - before)
+                print(f"[SHUTDOWN] {n} thread(s) completed in {duration:.2f} milliseconds.")
+
+            # record whatever finished, and move failures into the retry queue
+            for _ in handle_completed_futures(
+                futures,
+                failed=failed,
+                attempts=attempts,
+                retries=retries,
+                retry_policies=retry_policies,
+                timeout=0,
+            ):
                 pass
-            except:
-                shutdown()
-                raise
 
-            delay_remaining = next_future_at - now()
-            if delay_remaining < 0:
-                continue
+            save_checkpoint()
+            print(f"[CHECKPOINT] Saved to {checkpoint.path}")
+
+        checkpoint_at = now() + checkpoint_interval
+        try:
+            while True:
+                if len(futures) < threads * 2:
+                    pushed = push_one_future(
+                        executor,
+                        futures,
+                        allow_numbers=allow_numbers,
+                        resumed=resumed,
+                        candidates=candidates,
+                        failed=failed,
+                        attempts=attempts,
+                        retries=retries,
+                        headers=headers,
+                        request_timeout=request_timeout,
+                        order=orders[0],
+                    )
+
+                    if not pushed:
+                        if failed:
+                            failed.clear()
+                            continue
+
+                        if not futures and not retries:
+                            checkpoint.delete()
+                            print("Completed! All possible pairs have been made!")
+                            return
+
+                next_future_at = now() + seconds_per_request
+                rotated = False
+                try:
+                    for pair in handle_completed_futures(
+                        futures,
+                        failed=failed,
+                        attempts=attempts,
+                        retries=retries,
+                        retry_policies=retry_policies,
+                        timeout=next_future_at - now(),
+                    ):
+                        if not pair or pair.result.name.lower() == "nothing":
+                            orders.insert(0, orders.pop())
+                            rotated = True
+                except TimeoutError:
+                    pass
+
+                if rotated:
+                    refill_candidates(
+                        allow_numbers,
+                        resumed=resumed,
+                        candidates=candidates,
+                        failed=failed,
+                        futures=futures,
+                        attempts=attempts,
+                        order=orders[0],
+                    )
+
+                if now() >= checkpoint_at:
+                    save_checkpoint()
+                    checkpoint_at = now() + checkpoint_interval
+
+                delay_remaining = next_future_at - now()
+                if delay_remaining < 0:
+                    continue
 
-            try:
                 time.sleep(delay_remaining)
-            except:
-                shutdown()
-                raise
+        except:
+            shutdown()
+            raise
 
 
 if __name__ == "__main__":
@@ -0,0 +1,21 @@
+import time
+
+import persistence
+
+
+def search(query: str, mode: persistence.SearchMode, limit: int) -> None:
+    before = time.perf_counter()
+    results = list(persistence.search_elements(query, mode, limit))
+    duration = 1000 * (time.perf_counter() - before)
+
+    for element, pair in results:
+        if pair is None:
+            print(f"{element} (Primary Element)")
+        else:
+            print(pair)
+
+    print(f"Found {len(results)} element(s) in {duration:.2f} milliseconds.")
+
+
+if __name__ == "__main__":
+    search(input("Search: "), "ranked", 20)
@@ -0,0 +1,28 @@
+import time
+
+import persistence
+
+
+def stats(order: persistence.ElementStatsOrder, limit: int, rebuild: bool) -> None:
+    if rebuild:
+        before = time.perf_counter()
+        persistence.rebuild_element_stats()
+        duration = time.perf_counter() - before
+        print(f"[REBUILT] Element statistics rebuilt in {duration:.2f} seconds.")
+
+    n_elements, n_pairs, n_nothing, max_depth = persistence.element_stats_totals()
+    print(f"Pairs: {n_pairs:,d}  Elements: {n_elements:,d}  Nothing: {n_nothing:,d}", end="")
+    print("" if max_depth is None else f"  Deepest: {max_depth:,d}")
+
+    print(f"Top {limit:,d} elements by {order}:")
+    for i, element_stats in enumerate(persistence.select_element_stats(order, limit), 1):
+        addendum = (
+            f" ({element_stats.discovery_yield:.1%} yield)"
+            if order == "discovery_yield"
+            else ""
+        )
+        print(f"{i:>4}. {element_stats}{addendum}")
+
+
+if __name__ == "__main__":
+    stats("discovery_count", 20, False)